@@ -64,8 +64,9 @@ extract_and_transform_streeteasy_data = StreetEasyOperator(
     s3_bucket = Variable.get('s3_bucket'),
     s3_dest_bucket = Variable.get('s3_dest_bucket'),
     s3_key = "inferred_users.{ds}.csv.gz",
-    s3_dest_key = "unique_valid_searches_{ds}.csv",
-    s3_dest_df_key = "valid_searches_{ds}.csv",
+    s3_dest_key = "unique_valid_searches_{ds}.csv.gz",
+    s3_dest_df_key = "valid_searches_{ds}.csv.gz",
+    s3_dest_searches_key = "searches_{ds}.csv.gz",
 )
 
 calculate_valid_search_stats = ValidSearchStatsOperator(
@@ -84,7 +85,7 @@ calculate_valid_search_stats = ValidSearchStatsOperator(
         num_none_type_searches
     """,
     s3_bucket = Variable.get('s3_dest_bucket'),
-    s3_key = "valid_searches_{ds}.csv",
+    s3_key = "valid_searches_{ds}.csv.gz",
     today = "{ds}",
 )
 
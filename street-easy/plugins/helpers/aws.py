@@ -0,0 +1,50 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from airflow.contrib.hooks.aws_hook import AwsHook
+from s3fs.core import S3FileSystem
+
+@functools.lru_cache(maxsize=8)
+def get_s3_filesystem(aws_credentials_id):
+    ''' Returns a S3 file system authenticated with the given aws connection.
+        Additional details: cached per connection, so the airflow connection
+        lookup and the s3 session setup happen once per worker process.
+
+        :param aws_credentials_id: reference to aws hook containing iam details.
+        :type str
+        :return s3: file system to open s3 files with
+        :type s3fs.core.S3FileSystem
+    '''
+    credentials = AwsHook(aws_credentials_id).get_credentials()
+
+    # a larger connection pool lets the parallel uploads share connections
+    return S3FileSystem(anon=False, key=credentials.access_key, secret=credentials.secret_key,
+                        config_kwargs={'max_pool_connections': 32})
+
+
+def read_s3_file(s3, s3_path, part_size=16 << 20, max_workers=8):
+    ''' Reads a whole s3 file into memory with parallel range requests.
+        Additional details: a single stream waits on one small request after
+        another, concurrent ranges keep the connection pool busy instead.
+
+        :param s3: file system the file is read from
+        :type s3fs.core.S3FileSystem
+        :param s3_path: s3 path of the file
+        :type str
+        :param part_size: number of bytes fetched per range request
+        :type int
+        :param max_workers: number of range requests in flight
+        :type int
+        :return data: content of the file
+        :type bytes
+    '''
+    size = s3.info(s3_path)['size']
+
+    def read_part(start):
+        # no read-ahead cache, each part is fetched with exactly one range request
+        with s3.open(s3_path, mode='rb', block_size=part_size, cache_type='none') as s3_file:
+            s3_file.seek(start)
+            return s3_file.read(min(part_size, size - start))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return b''.join(executor.map(read_part, range(0, size, part_size)))
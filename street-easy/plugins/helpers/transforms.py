@@ -2,6 +2,25 @@ import re
 import pandas as pd
 import numpy as np
 
+# keys of a search we are interested in
+SEARCH_KEYS = ('search_id', 'enabled', 'clicks',
+               'type', 'listings_sent', 'recommended')
+SEARCH_KEYS_SET = frozenset(SEARCH_KEYS)
+# keys the vectorized summaries read, recommended is never used
+PARSED_SEARCH_KEYS = ('search_id', 'enabled', 'clicks',
+                      'type', 'listings_sent')
+# one pattern per parsed key, built once. the last occurrence of the key wins
+# and the surrounding whitespace is left out of the match instead of stripped
+SEARCH_KEY_PATTERNS = {
+    key: r'^(?:.*,)?{}:\s*([^,:]*?)\s*(?:[,:]|$)'.format(key)
+    for key in PARSED_SEARCH_KEYS
+}
+
+# escaped newlines and backslashes left in the raw searches
+ESCAPES_PATTERN = re.compile(r'(\\.n|\\.n\s+:|\\)')
+# whitespace before a colon starts the next key:value token
+TOKENS_PATTERN = re.compile(r'\s+:')
+
 def valid_searches(searches):
     ''' Parses the search string and returns only valid searches.
         Additional details: intended to be applied to a pandas series.
@@ -14,17 +33,16 @@ def valid_searches(searches):
     # each search is delimited by \\n-
     searches = searches.split('\\n-')
 
-    # filter the list
-    searches = [item for item in searches if not item.startswith('---')]
+    # filter the list and clean up the escapes in the same pass
+    searches = [ESCAPES_PATTERN.sub(' ', item) for item in searches
+                if not item.startswith('---')]
 
     # if no searches then return empty list otherwise keep parsing
     if len(searches) == 0:
         return []
     else:
         # parse the searches and make a list of searches
-        searches = [item for item in searches if not item.startswith('---')]
-        searches = [re.sub(r'(\\.n|\\.n\s+:|\\)', ' ', item) for item in searches]
-        searches = [re.sub(r'\s+:', ',', item) for item in searches]
+        searches = [TOKENS_PATTERN.sub(',', item) for item in searches]
         searches = [item.split(',') for item in searches]
 
         # Determine validity:
@@ -34,16 +52,103 @@ def valid_searches(searches):
         for item in searches:
             search_dict = {}
             for key in item:
-                if key.split(':')[0] in ('search_id', 'enabled', 'clicks',
-                                    'type', 'listings_sent', 'recommended'):
-                    d_key = key.split(':')[0]
-                    d_value = key.split(':')[1].strip()
-                    search_dict[d_key] = d_value
+                d_key, _, d_value = key.partition(':')
+                if d_key in SEARCH_KEYS_SET:
+                    # the value ends at the next colon
+                    search_dict[d_key] = d_value.partition(':')[0].strip()
             if search_dict['enabled'] == 'true' and int(search_dict.get('clicks', 0)) >= 3:
                 valid_searches.append(search_dict)
 
         return valid_searches
 
+def parse_valid_searches(data):
+    ''' Parses the searches of all users and returns only valid searches.
+        Additional details: vectorized version of valid_searches,
+        intended to be applied to the whole dataframe at once.
+
+        :param data: dataframe with user_id and raw unparsed searches
+        :type pandas.DataFrame
+        :return valid_searches: one row per valid search with user_id
+            and the parsed search keys as columns
+        :type pandas.DataFrame
+    '''
+    # each search is delimited by \\n-, one row per search
+    searches = data.set_index('user_id')['searches'].str.split(r'\\n-').explode()
+
+    # filter the searches
+    searches = searches[~searches.str.startswith('---', na=True)]
+
+    # parse the searches into comma separated key:value tokens
+    searches = searches.str.replace(ESCAPES_PATTERN.pattern, ' ', regex=True)
+    searches = searches.str.replace(TOKENS_PATTERN.pattern, ',', regex=True)
+
+    # pull out the value of each key used downstream, unused keys are never
+    # extracted. a repeated key keeps its last value, a missing key is NaN
+    searches = pd.DataFrame({
+        key: searches.str.extract(pattern, expand=False)
+        for key, pattern in SEARCH_KEY_PATTERNS.items()
+    })
+
+    # Determine validity:
+    # a valid search contains enabled==true and has clicks >= 3
+    searches['enabled'] = searches['enabled'].eq('true')
+    searches['clicks'] = pd.to_numeric(searches['clicks'], errors='coerce').astype('Int32')
+    searches = searches[searches['enabled'] & (searches['clicks'].fillna(0) >= 3)]
+
+    # type only takes a handful of values, compare it as a category.
+    # user_id stays as is, it is the groupby key downstream.
+    searches = searches.astype({'type': 'category'})
+    searches['listings_sent'] = pd.to_numeric(searches['listings_sent'],
+                                              errors='coerce').astype('Int32')
+
+    return searches.reset_index()
+
+def summarize_valid_searches(valid_searches):
+    ''' Summarizes the valid searches of each user in a single groupby.
+        Additional details: vectorized version of avg_listings_sent,
+        type_of_search and list_of_valid_searches.
+
+        :param valid_searches: one row per valid search, as returned
+            by parse_valid_searches
+        :type pandas.DataFrame
+        :return users: one row per user with num_valid_searches,
+            avg_listings, type_of_search and list_of_valid_searches
+        :type pandas.DataFrame
+    '''
+    # missing or empty keys are skipped, same as in the per-row version
+    search_id = valid_searches['search_id']
+    searches = pd.DataFrame({
+        'user_id': valid_searches['user_id'],
+        'search_id': search_id.where(search_id != ''),
+        'listings_sent': valid_searches['listings_sent'],
+        'rental': valid_searches['type'] == 'Rental',
+        'sale': valid_searches['type'] == 'Sale',
+    })
+
+    users = searches.groupby('user_id', sort=False).agg(
+        num_valid_searches=('rental', 'size'),
+        avg_listings=('listings_sent', 'mean'),
+        rental=('rental', 'any'),
+        sale=('sale', 'any'),
+    ).reset_index()
+
+    # both fit comfortably in 32 bits
+    users['num_valid_searches'] = users['num_valid_searches'].astype('int32')
+    users['avg_listings'] = users['avg_listings'].round(2).fillna(0).astype('float32')
+    users['type_of_search'] = np.select(
+        [users['rental'] & users['sale'], users['rental'], users['sale']],
+        ['rental_and_sale', 'rental', 'sale'],
+        default='none')
+
+    # prepare a list of valid search ids, a user without any gets an empty list
+    search_ids = searches.dropna(subset=['search_id']) \
+        .groupby('user_id', sort=False)['search_id'].agg(list).to_dict()
+    users['list_of_valid_searches'] = [search_ids.get(user_id, [])
+                                       for user_id in users['user_id']]
+
+    return users[['user_id', 'num_valid_searches', 'avg_listings',
+                  'type_of_search', 'list_of_valid_searches']]
+
 def avg_listings_sent(valid_searches):
     num_listings = 0
     listings = 0
@@ -1,15 +1,18 @@
-from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
-from helpers.transforms import valid_searches
-from helpers.transforms import avg_listings_sent
-from helpers.transforms import type_of_search
-from helpers.transforms import list_of_valid_searches
-
+from helpers.aws import get_s3_filesystem
+from helpers.aws import read_s3_file
+from helpers.transforms import parse_valid_searches
+from helpers.transforms import summarize_valid_searches
+
+import gzip
+import io
+import os
 import pandas as pd
-import numpy as np
-import re
-from s3fs.core import S3FileSystem
+import pyarrow as pa
+import rapidgzip
+from concurrent.futures import ThreadPoolExecutor
+from pyarrow import csv as pacsv
 
 class StreetEasyOperator(BaseOperator):
     """
@@ -23,17 +26,30 @@ class StreetEasyOperator(BaseOperator):
     :type s3_bucket: str
     :param s3_dest_bucket: destination s3 bucket name
     :type s3_dest_bucket: str
-    :param s3_key: source s3 file (templated)
+    :param s3_key: source s3 file (templated), either plain csv or compressed
+        with gzip (.gz), bzip2 (.bz2) or zstd (.zst)
     :type s3_key: Can receive a str representing a prefix,
         the prefix can contain a path that is partitioned by some field.
-    :param s3_dest_key: first destination s3 file (templated)
+    :param s3_dest_key: first destination s3 file (templated), gzip compressed
+        when it ends with .gz
     :type s3_dest_key: Can receive a str representing a prefix,
         the prefix can contain a path that is partitioned by some field.
-    :param s3_dest_df_key: second destination s3 file (templated)
+    :param s3_dest_df_key: second destination s3 file (templated), gzip compressed
+        when it ends with .gz
     :type s3_dest_df_key: Can receive a str representing a prefix,
         the prefix can contain a path that is partitioned by some field.
+    :param s3_dest_searches_key: optional third destination s3 file (templated)
+        with one row per valid search, gzip compressed when it ends with .gz
+    :type s3_dest_searches_key: Can receive a str representing a prefix,
+        the prefix can contain a path that is partitioned by some field.
     """
-    template_fields = ("s3_key", "s3_dest_key", "s3_dest_df_key",)
+    template_fields = ("s3_key", "s3_dest_key", "s3_dest_df_key", "s3_dest_searches_key",)
+    # codecs arrow can decompress, keyed by file extension.
+    # unlike gzip, bzip2 and zstd are block based and can be split by readers.
+    compression_codecs = {
+        '.bz2': 'bz2',
+        '.zst': 'zstd',
+    }
 
     @apply_defaults
     def __init__(self,
@@ -44,6 +60,7 @@ class StreetEasyOperator(BaseOperator):
                  s3_key="",
                  s3_dest_key="",
                  s3_dest_df_key="",
+                 s3_dest_searches_key="",
                  *args, **kwargs):
 
         super(StreetEasyOperator, self).__init__(*args, **kwargs)
@@ -54,95 +71,117 @@ class StreetEasyOperator(BaseOperator):
         self.s3_key = s3_key
         self.s3_dest_key = s3_dest_key
         self.s3_dest_df_key = s3_dest_df_key
-
+        self.s3_dest_searches_key = s3_dest_searches_key
+
+    def write_csv(self, df, s3, s3_path):
+        """
+        Stream a dataframe into s3 as csv, gzip compressed when s3_path ends with .gz
+        """
+        with s3.open(s3_path, mode='wb') as s3_file:
+            self.log.info("Started writing {} to {}".format(df.shape, s3_path))
+            # level 1 is much faster than the default and compresses csv almost as well
+            if s3_path.endswith('.gz'):
+                csv_file = gzip.GzipFile(fileobj=s3_file, mode='wb', compresslevel=1)
+            else:
+                csv_file = s3_file
+
+            # write the csv in chunks straight into the s3 buffer
+            with io.TextIOWrapper(csv_file, encoding='utf-8', newline='') as csv_text:
+                df.to_csv(csv_text, index=False, chunksize=100000)
+            self.log.info("Completed writing {} to {}".format(df.shape, s3_path))
 
     def execute(self, context):
         self.log.info("Executing StreetEasyOperator!!")
 
-        # get the aws hooks
-        aws_hook = AwsHook(self.aws_credentials_id)
-        aws_dest_hook = AwsHook(self.aws_credentials_dest_id)
-
-        # get the credentials for source and destination
-        credentials = aws_hook.get_credentials()
-        credentials_dest = aws_dest_hook.get_credentials()
-
         # build the s3 source path
         # as we are providing_context = True, we get them in kwargs form
         # use **context to upack the dictionary and format the s3_key
         rendered_key = self.s3_key.format(**context)
-        rendered_key_no_dashes = re.sub(r'-', '', rendered_key)
+        rendered_key_no_dashes = rendered_key.replace('-', '')
         self.log.info("Rendered Key no dashes {}".format(rendered_key_no_dashes))
         s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key_no_dashes)
 
-        # get a S3 file handle
-        s3 = S3FileSystem(anon=False, key=credentials.access_key, secret=credentials.secret_key)
+        # get a S3 file handle, cached per connection
+        s3 = get_s3_filesystem(self.aws_credentials_id)
 
         self.log.info("Extract data from {}".format(s3_path))
-        # stream data from s3 and transform it
-        with s3.open(s3_path, mode='rb') as s3_file:
-            # read in the data from s3
-            data = pd.read_csv(s3_file, compression='gzip', names=['user_id', 'searches'])
-
-            # create valid searches
-            data['valid_searches'] = data['searches'].apply(valid_searches)
-
-            # calculate num valid searches per user
-            data['num_valid_searches'] = data['valid_searches'].apply(len)
-
-            # keep only valid searches
-            data = data[data.num_valid_searches > 0].reset_index(drop=True)
-
-            # remove original searches
-            data = data.drop(['searches'], axis=1)
-
-            # calculate avg_listings_sent
-            data['avg_listings'] = data['valid_searches'].apply(avg_listings_sent)
-
-            # calculate type_of_search
-            data['type_of_search'] = data['valid_searches'].apply(type_of_search)
-
-            # prepare a list of valid search ids
-            data['list_of_valid_searches'] = data['valid_searches'].apply(list_of_valid_searches)
-
-            # drop valid searches as we don't need it anymore
-            data = data.drop(['valid_searches'], axis=1)
-
-            # get unique valid searches
-            unique_valid_searches = set()
-            for sublist in data['list_of_valid_searches']:
-                for item in sublist:
-                    unique_valid_searches.add(re.sub(r'\'', '', item))
+        # fetch the file into memory with parallel range requests,
+        # we don't want to store a local copy of the file on airflow worker's disk
+        s3_data = read_s3_file(s3, s3_path)
+        self.log.info("Fetched {} bytes from {}".format(len(s3_data), s3_path))
+
+        # decompress and transform the data in-memory
+        with io.BytesIO(s3_data) as s3_file:
+            # read in the data, the codec follows the file extension.
+            # rapidgzip decompresses gzip and arrow parses the csv with multiple threads
+            extension = os.path.splitext(rendered_key_no_dashes)[1]
+            if extension == '.gz':
+                with rapidgzip.open(s3_file, parallelization=os.cpu_count()) as gzip_file:
+                    csv_file = pa.BufferReader(pa.py_buffer(gzip_file.read()))
+            elif extension in StreetEasyOperator.compression_codecs:
+                csv_file = pa.CompressedInputStream(pa.BufferReader(s3_data),
+                                                    StreetEasyOperator.compression_codecs[extension])
+            else:
+                csv_file = pa.BufferReader(s3_data)
+
+            read_options = pacsv.ReadOptions(column_names=['user_id', 'searches'],
+                                             block_size=8 << 20)
+            data = pacsv.read_csv(csv_file, read_options=read_options).to_pandas()
+
+            # parse all the searches at once, one row per valid search
+            valid_searches = parse_valid_searches(data)
+
+            # summarize the valid searches of each user,
+            # users without valid searches are dropped
+            data = summarize_valid_searches(valid_searches)
+
+            # get unique valid searches straight from the parsed searches,
+            # skipping missing ids like list_of_valid_searches does
+            search_ids = valid_searches['search_id'].dropna()
+            unique_valid_searches = search_ids[search_ids != ''] \
+                .str.replace("'", "", regex=False).unique()
 
             # construct a dataframe
-            unique_valid_searches_df = pd.DataFrame({'searches': list(unique_valid_searches)})
+            unique_valid_searches_df = pd.DataFrame({'searches': unique_valid_searches})
 
-            self.log.info("Total valid searches today are: {}".format(np.sum(data['num_valid_searches'])))
-            self.log.info("Total users today are: {}".format(np.sum(data['num_valid_searches'] > 0)))
+            # users without valid searches are already dropped, so every row counts
+            self.log.info("Total valid searches today are: {}".format(int(data['num_valid_searches'].sum())))
+            self.log.info("Total users today are: {}".format(len(data)))
 
-        # build the s3 destination path
+        # build the s3 destination paths
         rendered_dest_key = self.s3_dest_key.format(**context)
-        rendered_dest_key_no_dashes = re.sub(r'-', '', rendered_dest_key)
+        rendered_dest_key_no_dashes = rendered_dest_key.replace('-', '')
         self.log.info("Rendered Key no dashes {}".format(rendered_dest_key_no_dashes))
         s3_dest_path = "s3://{}/{}".format(self.s3_dest_bucket, rendered_dest_key_no_dashes)
 
-        # get a S3 file handle for destination
-        s3_dest = S3FileSystem(anon=False, key=credentials_dest.access_key, secret=credentials_dest.secret_key)
-
-        # stream the transformed data into s3
-        with s3_dest.open(s3_dest_path, mode='wb') as s3_dest_file:
-            self.log.info("Started writing {}".format(unique_valid_searches_df.shape))
-            s3_dest_file.write(unique_valid_searches_df.to_csv(None, index=False).encode())
-            self.log.info("Completed writing {}".format(unique_valid_searches_df.shape))
-
         rendered_dest_df_key = self.s3_dest_df_key.format(**context)
-        rendered_dest_df_key_no_dashes = re.sub(r'-', '', rendered_dest_df_key)
+        rendered_dest_df_key_no_dashes = rendered_dest_df_key.replace('-', '')
         self.log.info("Rendered Key no dashes {}".format(rendered_dest_df_key_no_dashes))
         s3_dest_df_path = "s3://{}/{}".format(self.s3_dest_bucket, rendered_dest_df_key_no_dashes)
 
-        with s3_dest.open(s3_dest_df_path, mode='wb') as s3_dest_file:
-            self.log.info("Started writing {}".format(data.shape))
-            s3_dest_file.write(data.to_csv(None, index=False).encode())
-            self.log.info("Completed writing {}".format(data.shape))
+        outputs = [(unique_valid_searches_df, s3_dest_path), (data, s3_dest_df_path)]
+
+        # the valid searches themselves, one row per search.
+        # enabled is dropped as it is true for every valid search.
+        if self.s3_dest_searches_key:
+            rendered_dest_searches_key = self.s3_dest_searches_key.format(**context)
+            rendered_dest_searches_key_no_dashes = rendered_dest_searches_key.replace('-', '')
+            self.log.info("Rendered Key no dashes {}".format(rendered_dest_searches_key_no_dashes))
+            s3_dest_searches_path = "s3://{}/{}".format(self.s3_dest_bucket,
+                                                         rendered_dest_searches_key_no_dashes)
+
+            outputs.append((valid_searches.drop(['enabled'], axis=1), s3_dest_searches_path))
+
+        # get a S3 file handle for destination
+        s3_dest = get_s3_filesystem(self.aws_credentials_dest_id)
+
+        # stream the transformed data into s3,
+        # one thread per file so the uploads overlap instead of waiting on each other
+        with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+            futures = [executor.submit(self.write_csv, df, s3_dest, s3_path)
+                       for df, s3_path in outputs]
+            # re-raise the first failed upload, if any
+            for future in futures:
+                future.result()
 
         self.log.info("StreetEasyOperator completed")
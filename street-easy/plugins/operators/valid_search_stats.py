@@ -1,12 +1,10 @@
 from airflow.hooks.postgres_hook import PostgresHook
-from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers.aws import get_s3_filesystem
 
 import pandas as pd
 import numpy as np
-import re
-from s3fs.core import S3FileSystem
 
 class ValidSearchStatsOperator(BaseOperator):
     """
@@ -22,7 +20,7 @@ class ValidSearchStatsOperator(BaseOperator):
     :type columns: str containing column names in csv format.
     :param s3_bucket: source s3 bucket name
     :type s3_bucket: str
-    :param s3_key: source s3 file (templated)
+    :param s3_key: source s3 file (templated), gzip compressed when it ends with .gz
     :type s3_key: Can receive a str representing a prefix,
         the prefix can contain a path that is partitioned by some field.
     :param today: date of execution (templated)
@@ -57,12 +55,8 @@ class ValidSearchStatsOperator(BaseOperator):
 
     def execute(self, context):
         self.log.info('ValidSearchStatsOperator has started')
-        # get the hooks
+        # get the redshift hook
         redshift_hook = PostgresHook(self.redshift_conn_id)
-        aws_hook = AwsHook(self.aws_credentials_id)
-
-        # get the credentials for s3
-        credentials = aws_hook.get_credentials()
 
         # put the columns in the format INSERT table expect
         columns = "({})".format(self.columns)
@@ -71,19 +65,20 @@ class ValidSearchStatsOperator(BaseOperator):
         # as we are providing_context = True, we get them in kwargs form
         # use **context to upack the dictionary and format the s3_key
         rendered_key = self.s3_key.format(**context)
-        rendered_key_no_dashes = re.sub(r'-', '', rendered_key)
+        rendered_key_no_dashes = rendered_key.replace('-', '')
         self.log.info("Rendered Key no dashes {}".format(rendered_key_no_dashes))
         s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key_no_dashes)
 
-        # get a S3 file handle and pass in the creds
-        s3 = S3FileSystem(anon=False, key=credentials.access_key, secret=credentials.secret_key)
+        # get a S3 file handle for the connection
+        s3 = get_s3_filesystem(self.aws_credentials_id)
 
         # stream data from s3
         # we don't want to store a local copy of the file on airflow worker's disk
         # thus, we are processing this in-memory using with-open-file construct.
         with s3.open(s3_path, mode='rb') as s3_file:
             # read in the data from s3
-            data = pd.read_csv(s3_file)
+            compression = 'gzip' if rendered_key_no_dashes.endswith('.gz') else None
+            data = pd.read_csv(s3_file, compression=compression)
             self.log.info("Shape of the data is {}".format(data.shape))
 
             # as we are providing_context = True, we get them in kwargs form